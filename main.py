@@ -12,8 +12,9 @@ Assumes: data_pipeline.py is in same directory and defines DataPipeline and defa
 
 import streamlit as st
 import tempfile
-import json
-import os
+import re
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import List
 
@@ -22,6 +23,11 @@ from data_pipeline import DataPipeline, default_regex_patterns
 
 st.set_page_config(page_title="PII Data Pipeline Demo", layout="wide")
 
+# Number of sources handed to DataPipeline.run_batch per call
+RUN_BATCH_SIZE = 8
+# Maximum number of per-source run summaries kept in each session's cache
+RUN_CACHE_SIZE = 64
+
 # --------------------------
 # Helpers
 # --------------------------
@@ -35,8 +41,93 @@ def get_pipeline(output_dir: str = None, chunk_size: int = 1500, chunk_overlap:
     p.register_ml()  # placeholder
     return p
 
+@st.cache_resource
+def get_registered_patterns():
+    # pipelines are shared across sessions, so what is registered on them must be tracked globally too
+    return {}
+
+@st.cache_resource
+def get_pipeline_lock():
+    # sessions run on their own threads; serialize pattern registration and runs on the shared pipelines
+    return threading.RLock()
+
+def sync_regex_patterns(pipeline: DataPipeline, patterns: dict):
+    """Register patterns on the pipeline unless this exact set was the last one registered on it.
+
+    register_regex_patterns adds to the pipeline's patterns, so the snapshot records the last set
+    registered through this helper, not the pipeline's full pattern set.
+    """
+    snapshot = tuple(sorted(patterns.items()))
+    with get_pipeline_lock():
+        registered = get_registered_patterns()
+        if registered.get(id(pipeline)) == snapshot:
+            return
+        pipeline.register_regex_patterns(dict(patterns))
+        registered[id(pipeline)] = snapshot
+
+def run_batch_isolated(pipeline: DataPipeline, batch: List[str]):
+    """Run a batch; if it fails, retry its sources one at a time so files ahead of the failing one keep their results.
+
+    Returns (results, error), where error is the exception raised by the first failing source, or None.
+    """
+    try:
+        return pipeline.run_batch(batch, save_outputs=True), None
+    except Exception as e:
+        if len(batch) == 1:
+            return [], e
+    results = []
+    for src in batch:
+        try:
+            results.extend(pipeline.run_batch([src], save_outputs=True))
+        except Exception as e:
+            return results, e
+    return results, None
+
+def anonymized_output_path(output_dir: str, source: str, name: str) -> Path:
+    """Path where DataPipeline saves the given anonymizer's output for a source."""
+    safe_base = re.sub(r"[^\w\-_.]", "_", Path(source).name)
+    return Path(output_dir) / f"{safe_base}.{name}.anonymized.txt"
+
+def output_stamps(results: list, output_dir: str) -> dict:
+    """Map each saved anonymized output referenced by results to its mtime (None if missing)."""
+    stamps = {}
+    for r in results:
+        for name in r.get("anonymized_versions", {}):
+            path = anonymized_output_path(output_dir, r.get("source"), name)
+            stamps[str(path)] = path.stat().st_mtime_ns if path.exists() else None
+    return stamps
+
+def summarize_result(r: dict) -> dict:
+    """Keep only what the results view renders, so cached entries do not hold full anonymized text."""
+    summary = {k: r.get(k) for k in ("source", "dominant_type", "doc_type", "processed_at", "num_chunks", "entity_counts")}
+    summary["chunks"] = [
+        {
+            "chunk_meta": c.get("chunk_meta"),
+            "text_snippet": c.get("text_snippet"),
+            "classifications": [
+                # one character past the view's 120-char cut keeps its "..." marker
+                {"classifier": clf.get("classifier"),
+                 "results": [{"type": ent.get("type"), "value": str(ent.get("value"))[:121]} for ent in clf.get("results", [])[:10]]}
+                for clf in c.get("classifications", [])
+            ],
+        }
+        for c in r.get("chunks", [])[:5]
+    ]
+    summary["anonymized_versions"] = {name: preview[:2000] for name, preview in r.get("anonymized_versions", {}).items()}
+    return summary
+
+def run_cache_key(pipeline: DataPipeline, patterns: dict, source: str):
+    """Key a source's run results on the pipeline, the patterns just registered on it and the file's current state."""
+    stat = Path(source).stat()
+    return (id(pipeline), tuple(sorted(patterns.items())), source, stat.st_mtime_ns, stat.st_size)
+
 def save_uploaded_file(uploaded_file, dst_folder):
-    dst = Path(dst_folder) / uploaded_file.name
+    # one directory per upload so same-named uploads never share a path
+    dst = Path(dst_folder) / uploaded_file.file_id / uploaded_file.name
+    # Streamlit reruns the script on every interaction; each upload only needs writing once
+    if dst.exists():
+        return str(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
     with open(dst, "wb") as f:
         f.write(uploaded_file.getbuffer())
     return str(dst)
@@ -73,8 +164,14 @@ new_label = st.sidebar.text_input("Label (e.g., SSN)")
 new_pattern = st.sidebar.text_input("Pattern (Python regex)")
 if st.sidebar.button("Add pattern"):
     if new_label and new_pattern:
-        st.session_state.regex_patterns[new_label] = new_pattern
-        st.success(f"Added pattern: {new_label}")
+        # compile once here so invalid patterns are rejected before reaching the pipeline
+        try:
+            re.compile(new_pattern)
+        except re.error as e:
+            st.sidebar.error(f"Invalid regex: {e}")
+        else:
+            st.session_state.regex_patterns[new_label] = new_pattern
+            st.success(f"Added pattern: {new_label}")
     else:
         st.sidebar.error("Provide both label and pattern.")
 
@@ -115,17 +212,19 @@ if st.button("Initialize/Update Pipeline"):
     # NOTE: get_pipeline caches per args; to change patterns we manually register
     p = st.session_state.pipeline
     # Remove previously registered regex ones by re-creating pipeline would be ideal; here, just register new patterns
-    p.register_regex_patterns(st.session_state.regex_patterns.copy())
+    sync_regex_patterns(p, st.session_state.regex_patterns)
     st.success("Pipeline initialized/updated. Patterns registered.")
 
 # lazy init if not already
 if "pipeline" not in st.session_state:
     st.session_state.pipeline = get_pipeline(output_dir=out_dir, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     # ensure patterns loaded
-    st.session_state.pipeline.register_regex_patterns(st.session_state.regex_patterns.copy())
+    sync_regex_patterns(st.session_state.pipeline, st.session_state.regex_patterns)
 
 # Prepare sources list
-tmpdir = tempfile.mkdtemp(prefix="st_pipeline_")
+if "upload_dir" not in st.session_state:
+    st.session_state.upload_dir = tempfile.mkdtemp(prefix="st_pipeline_")
+tmpdir = st.session_state.upload_dir
 sources: List = []
 if uploaded:
     st.write(f"Uploaded {len(uploaded)} file(s). Saving temporarily...")
@@ -137,7 +236,18 @@ if uploaded:
 if local_paths_input.strip():
     lines = [l.strip() for l in local_paths_input.splitlines() if l.strip()]
     for p in lines:
-        sources.append(p)
+        # skip paths that do not exist rather than failing mid-run inside the pipeline
+        if Path(p).exists():
+            sources.append(p)
+        else:
+            st.warning(f"Skipping path that does not exist: {p}")
+
+# drop duplicate paths (order-preserving) so the same file is not processed twice,
+# comparing resolved paths so ./a.csv, a.csv and /abs/a.csv count as one
+unique_sources = {}
+for src in sources:
+    unique_sources.setdefault(Path(src).resolve(), src)
+sources = list(unique_sources.values())
 
 st.write("Files to process:")
 if not sources:
@@ -152,8 +262,6 @@ if st.button("Run pipeline"):
         st.error("No files provided.")
     else:
         pipeline: DataPipeline = st.session_state.pipeline
-        # update regex patterns before run (ensure latest)
-        pipeline.register_regex_patterns(st.session_state.regex_patterns.copy())
 
         st.info("Running pipeline — this may take a while for large files.")
         # Run and show a progress bar
@@ -161,12 +269,54 @@ if st.button("Run pipeline"):
         results = []
         try:
             total = len(sources)
-            # run per-source to show partial progress
-            for i, src in enumerate(sources):
-                st.write(f"Processing: {src}")
-                res = pipeline.run_batch([src], save_outputs=True)
+            # reuse results for sources unchanged since a previous run with the same pipeline and patterns
+            cache = st.session_state.setdefault("run_cache", OrderedDict())
+            keys = {src: run_cache_key(pipeline, st.session_state.regex_patterns, src) for src in sources}
+            pending = []
+            for src in sources:
+                entry = cache.get(keys[src])
+                # a hit is only valid if its saved outputs are still the files that run wrote
+                if entry is not None and output_stamps(entry[0], out_dir) == entry[1]:
+                    cache.move_to_end(keys[src])
+                    results.extend(entry[0])
+                else:
+                    pending.append(src)
+            if len(pending) < total:
+                st.write(f"Reusing cached results for {total - len(pending)} unchanged file(s).")
+            # run in small batches, still showing partial progress between them
+            batches = [pending[i:i + RUN_BATCH_SIZE] for i in range(0, len(pending), RUN_BATCH_SIZE)]
+            if pending:
+                st.write("Processing: " + ", ".join(str(s) for s in pending))
+            done = total - len(pending)
+            unmatched = []
+            for batch in batches:
+                # update regex patterns (ensure latest) and run under one lock so another session
+                # cannot register its patterns on the shared pipeline in between
+                with get_pipeline_lock():
+                    sync_regex_patterns(pipeline, st.session_state.regex_patterns)
+                    res, error = run_batch_isolated(pipeline, batch)
                 results.extend(res)
-                progress.progress(int((i + 1) / total * 100))
+                by_source = {}
+                for r in res:
+                    if r.get("source") in keys:
+                        by_source.setdefault(r.get("source"), []).append(summarize_result(r))
+                    else:
+                        unmatched.append(r.get("source"))
+                for src, src_results in by_source.items():
+                    cache[keys[src]] = (src_results, output_stamps(src_results, out_dir))
+                while len(cache) > RUN_CACHE_SIZE:
+                    cache.popitem(last=False)
+                if error is not None:
+                    raise error
+                done += len(batch)
+                progress.progress(int(done / total * 100))
+            progress.progress(100)
+            if unmatched:
+                st.warning("Results not matched to an input path (not cached, shown last): "
+                           + ", ".join(str(src) for src in unmatched))
+            # cached results were emitted first; restore the order the sources were listed in
+            position = {src: i for i, src in enumerate(sources)}
+            results.sort(key=lambda r: position.get(r.get("source"), total))
             st.success("Pipeline run complete.")
         except Exception as e:
             st.exception(e)
@@ -194,20 +344,18 @@ if st.button("Run pipeline"):
                             st.write(" -", clf.get("classifier"))
                             # show up to 10 entities per classifier
                             for ent in clf.get("results", [])[:10]:
-                                st.write("    •", ent.get("type"), "=>", (ent.get("value")[:120] + "...") if len(str(ent.get("value"))) > 120 else ent.get("value"))
+                                value = str(ent.get("value"))
+                                st.write("    •", ent.get("type"), "=>", (value[:120] + "...") if len(value) > 120 else value)
 
                     st.markdown("### Anonymized versions (preview)")
                     for name, anon_preview in r.get("anonymized_versions", {}).items():
                         st.write(f"**{name}** (preview)")
                         st.code(anon_preview[:2000])
                         # full download button (load actual file from output_dir)
-                        base = Path(r.get("source")).name
-                        safe_base = re.sub(r"[^\w\-_.]", "_", base)
-                        file_path = Path(out_dir) / f"{safe_base}.{name}.anonymized.txt"
+                        file_path = anonymized_output_path(out_dir, r.get("source"), name)
                         if file_path.exists():
-                            with open(file_path, "r", encoding="utf-8") as f:
-                                content = f.read()
-                            st.download_button(f"Download {name} anonymized", data=content, file_name=f"{safe_base}.{name}.anonymized.txt")
+                            # download_button holds the full payload either way; reading bytes just skips a decode/re-encode
+                            st.download_button(f"Download {name} anonymized", data=file_path.read_bytes(), file_name=file_path.name, mime="text/plain")
                         else:
                             st.write("No file saved for this anonymizer.")
 